@@ -1,25 +1,40 @@
-from multiprocessing.sharedctypes import Value
 import urllib.parse
 import os.path
-import re
 import argparse
+import copy
+import functools
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from email.utils import formatdate
+from xml.sax.saxutils import escape
 
 # local copy
 import visualise
 
+# Applied after the standard XML escapes, in a single pass
+ESC_TABLE = str.maketrans(
+    {"\n": " ", "\t": " ", "\b": " ", "\r": " ", "\f": " ", "/": "&#47;"}
+)
+
+
 def esc(str):
     """XML escape, but forward slashes are also converted to entity references
     and whitespace control characters are converted to spaces"""
-    from xml.sax.saxutils import escape
+    return escape(str).translate(ESC_TABLE)
+
+# Building the parser is comparatively expensive and the defaults never change,
+# so parse them once and take a (shallow) copy per request.
+DEFAULT_ARGS = visualise.get_args("")
 
-    return escape(
-        str, {"\n": " ", "\t": " ", "\b": " ", "\r": " ", "\f": " ", "/": "&#47;"}
-    )
 
 def make_args(query_dict):
     """Update the argparse namespace from the query dict."""
 
-    A = visualise.get_args("")
+    A = copy.copy(DEFAULT_ARGS)
 
     for k in query_dict:
         if k in vars(A):
@@ -47,6 +62,144 @@ def make_args(query_dict):
     return visualise.validate_args(A)
 
 
+def content_disposition(query_dict, A):
+    """Name the file we return, if it's to be downloaded."""
+    if query_dict.get("dl", False):
+        return (
+            'download; filename="'
+            + f"3pp_vis_g{A.green_to_red:g}_r{A.red_to_green:g}_b{A.blue_to_red:g}_f{A.start}_t{A.stop}_s{A.step}.svg"
+        )
+    return "inline"
+
+
+# Query parameters that can affect the response. Anything else is ignored,
+# and kept out of the cache keys so that junk parameters can't flood the caches.
+QUERY_KEYS = frozenset(vars(DEFAULT_ARGS)) | {"px", "py", "pl", "dl"}
+
+
+@functools.lru_cache(maxsize=2048)
+def parse_query(query_string):
+    """Parse a raw query string. The result is shared between requests, so it's read-only."""
+    return MappingProxyType({k: tuple(v) for (k, v) in urllib.parse.parse_qs(query_string).items()})
+
+
+def canonical_query(query_dict):
+    """The parameters we use from the query dict, as a hashable and order-independent tuple."""
+    return tuple(sorted((k, tuple(v)) for (k, v) in query_dict.items() if k in QUERY_KEYS))
+
+
+@functools.lru_cache(maxsize=1024)
+def response_for_query(query):
+    """For a `canonical_query`, the `args_key` of its validated arguments, their `etag` and its Content-Disposition.
+    Distinct queries that validate to the same arguments then share a `render_svg` cache entry."""
+    query_dict = {k: list(v) for (k, v) in query}
+    A = make_args(query_dict)
+    key = args_key(A)
+    return (key, etag(key), content_disposition(query_dict, A))
+
+
+# Responses are a pure function of the query string, so let everyone cache them:
+# a day in the browser, a week in shared caches.
+MAX_AGE = 86400
+CACHE_CONTROL = f"public, max-age={MAX_AGE}, s-maxage={7 * MAX_AGE}, immutable"
+
+
+# Namespace attributes that don't affect the rendered SVG (and may not be hashable)
+UNCACHED_ARGS = ("css", "input", "output")
+
+
+def freeze(val):
+    """Convert lists (e.g. marks, points) to tuples, recursively, so they can be hashed."""
+    if isinstance(val, list):
+        return tuple(freeze(v) for v in val)
+    return val
+
+
+def args_key(A):
+    """A hashable cache key for the validated argument namespace."""
+    return frozenset((k, freeze(v)) for (k, v) in vars(A).items() if k not in UNCACHED_ARGS)
+
+
+# The SVG depends only on the arguments and on the rendering code itself,
+# so any change to the latter (including its default CSS) changes every ETag
+with open(visualise.__file__, "rb") as f:
+    RENDER_VERSION = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def etag(key):
+    """The (quoted) ETag of the SVG for a key produced by `args_key`, worked out without rendering it."""
+    # (sorting by name makes the repr independent of the order the namespace was built in)
+    digest = hashlib.blake2b(repr(sorted(key)).encode("utf8"), digest_size=16, key=RENDER_VERSION.encode("ascii"))
+    return '"' + digest.hexdigest() + '"'
+
+
+# Rendered SVGs can run to megabytes, and any change to the query makes a new one,
+# so the cache is bounded by total size rather than entry count. Only the compressed copy is kept
+# (a big SVG is around 15x smaller gzipped), and any one body over the limit isn't cached at all.
+RENDER_CACHE_BYTES = 32 * 1024 * 1024
+RENDER_CACHE_MAX_BODY = 1024 * 1024
+
+_render_cache = OrderedDict()  # key -> gzipped body, least recently used first
+_render_cache_bytes = 0
+_render_cache_lock = threading.Lock()
+
+
+def render(key):
+    """The gzip-compressed, UTF-8 encoded SVG for a key produced by `args_key`."""
+    global _render_cache_bytes
+
+    with _render_cache_lock:
+        if key in _render_cache:
+            _render_cache.move_to_end(key)
+            return _render_cache[key]
+
+    A = argparse.Namespace(css=None, input=None, output=None, **dict(key))
+    # Encode as we go, so we never hold the whole SVG as both str and bytes.
+    # (The response itself is buffered: the cache needs the complete body.)
+    # No timestamp in the gzip header, so every worker (and every re-render) sends the same bytes
+    # under the same strong ETag.
+    body = gzip.compress(b"".join(chunk.encode("utf8") for chunk in visualise.construct_svg_iter(A)),
+                         compresslevel=6, mtime=0)
+
+    if len(body) <= RENDER_CACHE_MAX_BODY:
+        with _render_cache_lock:
+            if key not in _render_cache:
+                _render_cache[key] = body
+                _render_cache_bytes += len(body)
+            while _render_cache_bytes > RENDER_CACHE_BYTES:
+                (_, old) = _render_cache.popitem(last=False)
+                _render_cache_bytes -= len(old)
+
+    return body
+
+
+def render_svg(key):
+    """The UTF-8 encoded SVG for a key produced by `args_key`.
+    Decompressing the cached copy is much cheaper than rendering, and most clients accept gzip anyway."""
+    return gzip.decompress(render(key))
+
+
+def render_svg_gzip(key):
+    """As `render_svg`, but gzip-compressed."""
+    return render(key)
+
+
+def etag_matches(etag, if_none_match):
+    """Does an If-None-Match header value match our ETag?"""
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))
+
+
+def cache_headers(etag):
+    """Caching-related response headers, including an Expires for HTTP/1.0 caches."""
+    return [
+        ("Cache-Control", CACHE_CONTROL),
+        ("Expires", formatdate(time.time() + MAX_AGE, usegmt=True)),
+        ("ETag", etag),
+        ("Vary", "Accept-Encoding"),
+    ]
+
 
 def application(env, start_response):
     head = ["200 OK", [("Content-Type", "text/html")]]
@@ -58,34 +211,36 @@ def application(env, start_response):
     page_root = os.path.dirname(env["PATH_INFO"])[1:]  # drop leading /
 
     # do intelligent things based on env['QUERY_STRING']
-    query_dict = urllib.parse.parse_qs(env["QUERY_STRING"])
+    query_dict = parse_query(env["QUERY_STRING"])
 
     try:
         # Now get the response out
-        A = make_args(query_dict)
-        body = visualise.construct_svg(A).encode("utf8")
-
-        # Name the file we return
-        if query_dict.get("dl", False):
-            head[1].append(
-                (
-                    "Content-Disposition",
-                    (
-                        'download; filename="'
-                        + f"3pp_vis_g{A.green_to_red:g}_r{A.red_to_green:g}_b{A.blue_to_red:g}_f{A.start}_t{A.stop}_s{A.step}.svg"
-                    ),
-                )
-            )
+        (key, tag, disposition) = response_for_query(canonical_query(query_dict))
+        # SVG is very repetitive, so it compresses extremely well
+        gzipped = "gzip" in env.get("HTTP_ACCEPT_ENCODING", "")
+        if gzipped:
+            # (a distinct ETag, as it's a different representation)
+            tag = tag[:-1] + '-gzip"'
+
+        # The ETag doesn't depend on the body, so we can answer this before rendering anything
+        if etag_matches(tag, env.get("HTTP_IF_NONE_MATCH", "")):
+            start_response("304 Not Modified", cache_headers(tag))
+            return [b""]
+
+        if gzipped:
+            body = render_svg_gzip(key)
+            head[1].append(("Content-Encoding", "gzip"))
         else:
-            head[1].append(("Content-Disposition", "inline"))
-        
-        # cache it for a day, but only in the browser
-        head[1].append(("Cache-Control", "private; max-age=86400"))
+            body = render_svg(key)
+
+        head[1].append(("Content-Disposition", disposition))
+        head[1].extend(cache_headers(tag))
 
     except ValueError as e:
-        head = ["400 Bad Request", ("Content-Type", "text/html")]
-        body = ("\r\n".join(head[0], str(e) + repr(query_dict))).encode("utf8")
+        head = ["400 Bad Request", [("Content-Type", "text/plain; charset=utf-8")]]
+        body = ("\r\n".join([head[0], str(e) + repr(dict(query_dict))])).encode("utf8")
 
+    head[1].append(("Content-Length", str(len(body))))
 
     start_response(head[0], head[1])
     return [body]
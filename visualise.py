@@ -8,17 +8,23 @@ We'll call the three parties "blue" (x-axis), "green" (y-axis) and "red" (with R
 The primary methods that you'll want to call are `get_args` and `construct_svg`.
 """
 
-from typing import Tuple
+from typing import Callable, Iterator, List, Optional, Tuple
 import sys
 import math
+import csv
+import contextlib
 from enum import Enum
 import argparse
+import itertools
+import functools
 DEFAULT_CSS = """
 text {font-family: sans-serif; font-size: 10px; fill: #222;}
 text.label {filter: url(#keylineEffect); font-weight: bold}
 /* dot, red, green, blue, tie*/
-.d {opacity:0.6;}
-.d:hover {opacity:1;}
+/* (grid dots are <use>s of the #dr, #dg, #db and #dt circles) */
+.d, use {opacity:0.6;}
+.regions {opacity:0.6;}
+.d:hover, use:hover {opacity:1;}
 .r {fill: #d04}
 .g {fill: #0a2}
 .b {fill: #08e}
@@ -38,6 +44,14 @@ class Party(Enum):
     GREEN = ("Greens", "g")
     BLUE = ("Coalition", "b")
 
+
+# (name, CSS class) for each party: `Party.value` goes through the Enum machinery,
+# which is comparatively slow when it's done for every dot
+PARTY_INFO = {party: party.value for party in Party}
+
+# What `calculate_winner` returns: the winner and their 2CP margin, or None for a tie
+Result = Optional[Tuple[Party, float]]
+
 # NOTE: throughout this file we'll use a variable called `A` to store our general state
 # This replaces the original and pervasive use of globals.
 # Default values are set in `get_args`
@@ -48,208 +62,295 @@ def p2c(blue_pct: float, green_pct: float, A: argparse.Namespace) -> Tuple[float
     # trying to account for being out-of-frame here was worse than not doing it
     # additional context is needed and hence now line() exists
 
-    x = ((blue_pct - A.start) / (A.stop - A.start)) * \
-        A.inner_width + A.offset * A.scale
-    y = A.inner_width * (1 - ((green_pct - A.start) /
-                         (A.stop - A.start))) + A.scale
-
-    return (x, y)
-
-
-def calculate_winner(red_pct: float, green_pct: float, blue_pct: float, A: argparse.Namespace) -> Tuple[Party, float]:
-    '''Given 3PP percentages, calculate the winner and their 2CP result. 
-        Ties for third are resolved where the winner is the same either way, 
-        with the tighter 2CP result reported.'''
-
-    def eq(x, y):
-        """Equal, to a certain tolerance"""
-        # sufficiently close for our purposes
-        return math.isclose(x, y, abs_tol=A.step/10.0)
-
-    def lt(x, y):
-        """Strictly less than, beyond a certain tolerance"""
-        return (x < y) and not eq(x, y)
-
-    def gt(x, y):
-        """Strictly greater than, beyond a certain tolerance"""
-        return lt(y, x)
-
-    # need to figure out who came third, then who won
-    if lt(red_pct, green_pct) and lt(red_pct, blue_pct):
-        # Red came third
-        green_2cp = green_pct + (A.red_to_green * red_pct)
-        blue_2cp = blue_pct + (A.red_to_blue * red_pct)
-        margin = green_2cp / (green_2cp + blue_2cp) - 0.5
-        if gt(green_2cp, blue_2cp):
-            return (Party.GREEN, margin)
-        elif gt(blue_2cp, green_2cp):
-            return (Party.BLUE, -margin)
-    if lt(green_pct, red_pct) and lt(green_pct, blue_pct):
-        # Green came third
-        red_2cp = red_pct + (A.green_to_red * green_pct)
-        blue_2cp = blue_pct + (A.green_to_blue * green_pct)
-        margin = red_2cp / (red_2cp + blue_2cp) - 0.5
-        if gt(red_2cp, blue_2cp):
-            return (Party.RED, red_2cp)
-        elif gt(blue_2cp, margin):
-            return (Party.BLUE, -margin)
-    if lt(blue_pct, green_pct) and lt(blue_pct, red_pct):
-        # Blue came third
-        red_2cp = red_pct + (A.blue_to_red * blue_pct)
-        green_2cp = green_pct + (A.blue_to_green * blue_pct)
-        margin = red_2cp / (green_2cp + red_2cp) - 0.5
-        if gt(red_2cp, green_2cp):
-            return (Party.RED, margin)
-        elif gt(green_2cp, red_2cp):
-            return (Party.GREEN, -margin)
-
-    # print("likely tie:", green_pct, red_pct, blue_pct, file=sys.stderr)
-
-    # resolve ties for third with casting vote of A.step/10
-    # if the leading party would win EITHER way, report their win and tightest margin
-    # else, return nothing (interpreted as a tie)
-    if eq(green_pct, blue_pct) and lt(green_pct, red_pct):
-        # Red leading
-
-        # casting vote to exclude Green
-        gex = calculate_winner(red_pct, green_pct -
-                               A.step/10.0, blue_pct + A.step/10.0, A)
-        # casting vote to exclude Blue
-        bex = calculate_winner(red_pct, green_pct +
-                               A.step/10.0, blue_pct - A.step/10.0, A)
-
-        if gex[0] == Party.RED and bex[0] == Party.RED:
-            return (Party.RED, min(gex[1], bex[1]))
-
-    if eq(red_pct, blue_pct) and lt(red_pct, green_pct):
-        # Green leading
-
-        # casting vote to exclude Red
-        rex = calculate_winner(red_pct - A.step/10,
-                               green_pct, blue_pct + A.step/10, A)
-        # casting vote to exclude Blue
-        bex = calculate_winner(red_pct + A.step/10,
-                               green_pct, blue_pct - A.step/10, A)
-
-        if rex[0] == Party.GREEN and bex[0] == Party.GREEN:
-            return (Party.GREEN, min(rex[1], bex[1]))
-
-    if eq(green_pct, red_pct) and lt(green_pct, blue_pct):
-        # Blue leading
-
-        # casting vote to exclude Green
-        gex = calculate_winner(red_pct + A.step/10, green_pct -
-                               A.step/10, blue_pct, A)
-        # casting vote to exclude Red
-        rex = calculate_winner(red_pct - A.step/10, green_pct +
-                               A.step/10, blue_pct, A)
-
-        if gex[0] == Party.BLUE and rex[0] == Party.BLUE:
-            return (Party.BLUE, min(gex[1], rex[1]))
-
-    # print("actual tie:", green_pct, red_pct, blue_pct, file=sys.stderr)
-
+    # it's an affine transform, with the constants worked out in validate_args
+    return (blue_pct * A.pct_scale + A.x_bias, A.y_bias - green_pct * A.pct_scale)
 
-def construct_dot(blue_pct: float, green_pct: float, A: argparse.Namespace) -> str:
-    '''Given green and blue percentages, return an SVG fragment corresponding to a dot at the appropriate position.'''
-    red_pct = 1.0 - (green_pct + blue_pct)
 
-    (x, y) = p2c(blue_pct, green_pct, A)
+# `tied_third_code` returns an index into PARTIES, or TIE
+PARTIES = (Party.RED, Party.GREEN, Party.BLUE)
+TIE = -1
+# for each party (by index), the indices of the other two
+OTHERS = ((1, 2), (0, 2), (0, 1))
 
-    tooltip_3cp = f"{Party.GREEN.value[0]}: {green_pct:.1%}, {Party.RED.value[0]}: {red_pct:.1%}, {Party.BLUE.value[0]}: {blue_pct:.1%}."
 
-    try:
-        (winner, margin) = calculate_winner(red_pct, green_pct, blue_pct, A)
-        tooltip = f"{tooltip_3cp} Winner: {(winner.value)[0]} {margin:.1%}"
-        return f'<circle cx="{x:g}" cy="{y:g}" r="{A.radius:g}" class="{(winner.value)[1]} d"><title>{tooltip}</title></circle>'.replace(".0%", "%")
-
-    except TypeError:  # raised on a tie
-        tooltip = f"{tooltip_3cp} Winner: TIE"
-        return f'<circle cx="{x:g}" cy="{y:g}" r="{A.radius:g}" class="t d"><title>{tooltip}</title></circle>'.replace(".0%", "%")
+def tied_third_code(red_pct: float, green_pct: float, blue_pct: float,
+                    red_to_green: float, red_to_blue: float,
+                    green_to_red: float, green_to_blue: float,
+                    blue_to_red: float, blue_to_green: float, tol: float) -> Tuple[int, float]:
+    '''The scalar core of `calculate_winner` for when third place ISN'T clear, i.e. two of the
+        percentages are within `tol` of each other and not clearly ahead of the third.
+        (The usual case, where it is clear, is handled by `specialise_winner` before this is called;
+        this doesn't check for it.) Preference flows are passed as plain floats (rather than via `A`)
+        and the winner is returned as an index into PARTIES, or TIE.
+        There are no closures or objects here, only scalars in and out, so it can be JIT-compiled as-is.'''
 
+    # Comparisons are made to a tolerance of `tol`, written out inline as they're on the hot path:
+    # x == y is `abs(x - y) <= tol`; x < y is `y - x > tol`; x > y is `x - y > tol`
 
-def frange(start, stop=None, step=None) -> float:
-    '''Floating-point range. [start = 0.0], stop, [step = 1.0]'''
-    start = float(start)
-    if not stop:  # switcheroo
-        stop = start
-        start = 0.0
-    if not step:
-        step = 1.0
+    pcts = (red_pct, green_pct, blue_pct)
+    # flows[i][j] is the preference flow from party i to party j
+    flows = ((0.0, red_to_green, red_to_blue),
+             (green_to_red, 0.0, green_to_blue),
+             (blue_to_red, blue_to_green, 0.0))
 
-    count = 0.0
-    while True:
-        t = start + count * step
-        if stop > 0.0 and t >= stop:
-            break
-        elif stop < 0.0 and t <= stop:
-            break
-        yield t
-        count += 1.0
+    # print("likely tie:", green_pct, red_pct, blue_pct, file=sys.stderr)
 
+    # resolve ties for third with casting vote of tol
+    # if the leading party would win EITHER way, report their win and tightest margin
+    # else, return TIE
+    # (exact ties for the lead go to the highest index)
+    if red_pct > green_pct and red_pct > blue_pct:
+        leader = 0
+    elif green_pct > blue_pct:
+        leader = 1
+    else:
+        leader = 2
+    (a, b) = OTHERS[leader]
+
+    if abs(pcts[a] - pcts[b]) <= tol and pcts[leader] - pcts[a] > tol:
+        # With a casting vote of `tol` the excluded party is clearly third,
+        # so each way round it's straight to the leader's 2CP against the other.
+        lead_pct = pcts[leader]
+        # casting vote to exclude `a`
+        a_out = pcts[a] - tol
+        lead_2cp_aex = lead_pct + (flows[a][leader] * a_out)
+        b_2cp = pcts[b] + tol + (flows[a][b] * a_out)
+        if lead_2cp_aex - b_2cp > tol:
+            # casting vote to exclude `b`
+            b_out = pcts[b] - tol
+            lead_2cp_bex = lead_pct + (flows[b][leader] * b_out)
+            a_2cp = pcts[a] + tol + (flows[b][a] * b_out)
+            if lead_2cp_bex - a_2cp > tol:
+                # (margins are worked out from the lower-indexed party's share, as `specialise_winner` does)
+                if leader < b:
+                    aex_margin = lead_2cp_aex / (lead_2cp_aex + b_2cp) - 0.5
+                else:
+                    aex_margin = 0.5 - b_2cp / (b_2cp + lead_2cp_aex)
+                if leader < a:
+                    bex_margin = lead_2cp_bex / (lead_2cp_bex + a_2cp) - 0.5
+                else:
+                    bex_margin = 0.5 - a_2cp / (a_2cp + lead_2cp_bex)
+                return (leader, min(aex_margin, bex_margin))
 
-def clamp_val(val: float, lo: float, hi: float) -> float:
-    """Constrain val to be between hi and lo"""
-    return max(min(val, hi), lo)
+    # print("actual tie:", green_pct, red_pct, blue_pct, file=sys.stderr)
+    return (TIE, 0.0)
 
 
-def clamp(val: float, A: argparse.Namespace) -> float:
-    """Constrain val to be within A.start and A.stop"""
-    return clamp_val(val, A.start, A.stop)
+def calculate_winner(red_pct: float, green_pct: float, blue_pct: float, A: argparse.Namespace) -> Result:
+    '''Given 3PP percentages, calculate the winner and their 2CP result. 
+        Ties for third are resolved where the winner is the same either way, 
+        with the tighter 2CP result reported.
+        Returns None on a tie.'''
+    return make_winner_fn(A)(red_pct, green_pct, blue_pct)
+
+
+def make_winner_fn(A: argparse.Namespace) -> Callable[[float, float, float], Result]:
+    '''Specialise `calculate_winner` to the preference flows in `A` (which are fixed for a whole graph),
+        returning a function of just the red, green and blue percentages.'''
+    return specialise_winner(A.prefs, A.tol)
+
+
+@functools.lru_cache(maxsize=32)
+def specialise_winner(prefs: Tuple[float, ...], tol: float) -> Callable[[float, float, float], Result]:
+    '''The work of `make_winner_fn`, given `A.prefs` and `A.tol`. It's cached, so repeated
+        `calculate_winner` calls (and repeat renders) reuse the same specialised function.'''
+    (red_to_green, red_to_blue, green_to_red, green_to_blue, blue_to_red, blue_to_green) = prefs
+    (RED, GREEN, BLUE) = PARTIES
+
+    def winner_fn(red_pct: float, green_pct: float, blue_pct: float) -> Result:
+        # The usual case, where third place is clear, is written out here for each party
+        # (the margin is worked out from the lower-indexed party's share, and negated if the other wins).
+        # Anything closer than that goes to `tied_third_code`.
+        if red_pct <= green_pct and red_pct <= blue_pct:
+            if green_pct - red_pct > tol and blue_pct - red_pct > tol:
+                green_2cp = green_pct + (red_to_green * red_pct)
+                blue_2cp = blue_pct + (red_to_blue * red_pct)
+                margin = green_2cp / (green_2cp + blue_2cp) - 0.5
+                if green_2cp - blue_2cp > tol:
+                    return (GREEN, margin)
+                elif blue_2cp - green_2cp > tol:
+                    return (BLUE, -margin)
+                return None
+        elif green_pct <= blue_pct:
+            if red_pct - green_pct > tol and blue_pct - green_pct > tol:
+                red_2cp = red_pct + (green_to_red * green_pct)
+                blue_2cp = blue_pct + (green_to_blue * green_pct)
+                margin = red_2cp / (red_2cp + blue_2cp) - 0.5
+                if red_2cp - blue_2cp > tol:
+                    return (RED, margin)
+                elif blue_2cp - red_2cp > tol:
+                    return (BLUE, -margin)
+                return None
+        elif red_pct - blue_pct > tol and green_pct - blue_pct > tol:
+            red_2cp = red_pct + (blue_to_red * blue_pct)
+            green_2cp = green_pct + (blue_to_green * blue_pct)
+            margin = red_2cp / (red_2cp + green_2cp) - 0.5
+            if red_2cp - green_2cp > tol:
+                return (RED, margin)
+            elif green_2cp - red_2cp > tol:
+                return (GREEN, -margin)
+            return None
+
+        (code, margin) = tied_third_code(red_pct, green_pct, blue_pct,
+                                         red_to_green, red_to_blue,
+                                         green_to_red, green_to_blue,
+                                         blue_to_red, blue_to_green, tol)
+        if code == TIE:
+            return None
+        return (PARTIES[code], margin)
+
+    return winner_fn
+
+
+# Bound `str.format`s of the (fixed) dot and tooltip templates, so the templates are only parsed once.
+# Grid dots reference the template dot for their outcome (see `construct_svg_iter`) rather than repeating it.
+FORMAT_DOT = '<use xlink:href="#d{}" x="{}" y="{}"><title>{} Winner: {}</title></use>'.format
+FORMAT_BAR = '<rect x="{:g}" y="{:g}" width="{:g}" height="{:g}" class="{} d"><title>Winner: {}</title></rect>'.format
+FORMAT_3CP = f"{Party.GREEN.value[0]}: {{}}, {Party.RED.value[0]}: {{}}, {Party.BLUE.value[0]}: {{}}.".format
+FORMAT_POI = '<circle cx="{:g}" cy="{:g}" r="{}" class="d poi"><title>{}</title></circle>\r\n'.format
+
+
+def pct(val: float) -> str:
+    '''Format as a percentage to one decimal place, dropping the decimal if it's zero.'''
+    s = format(val, ".1%")
+    return s[:-3] + "%" if s.endswith(".0%") else s
+
+
+def format_dot(x: str, y: str, red_pct: str, green_pct: str, blue_pct: str, result: Result) -> str:
+    '''The SVG fragment for a dot at coordinates (x, y), given its `calculate_winner` result.
+        The coordinates and percentages are passed in already formatted (with `{:g}` and `pct`).'''
+    tooltip_3cp = FORMAT_3CP(green_pct, red_pct, blue_pct)
+
+    if result is None:  # a tie
+        (cls, result) = ("t", "TIE")
+    else:
+        (winner, margin) = result
+        (name, cls) = PARTY_INFO[winner]
+        result = name + " " + pct(margin)
+
+    return FORMAT_DOT(cls, x, y, tooltip_3cp, result)
+
+
+def outcome_class(result: Result) -> str:
+    '''The CSS class for a `calculate_winner` result.'''
+    return "t" if result is None else PARTY_INFO[result[0]][1]
+
+
+# With --decimate, runs of more than this many same-winner dots in a column are thinned out
+DECIMATE_MIN_RUN = 5
+
+
+def grid_pcts(A: argparse.Namespace) -> Tuple[float, ...]:
+    '''The percentages along each axis of the grid, from A.start to A.stop inclusive.'''
+    # computed from an integer count (rather than accumulated) so there's no floating-point drift
+    count = int(math.floor((A.stop - A.start) / A.step + 1e-9)) + 1
+    return tuple(A.start + i * A.step for i in range(count))
+
+
+def dot_grid(A: argparse.Namespace) -> List[Tuple[float, float, list]]:
+    '''Calculate the whole grid of dots in one pass, ahead of any SVG formatting.
+        Returns (blue, x, column) for each column of fixed blue, where `column` holds
+        (y, red, green, result) for each of its dots, in order of increasing green.
+        So the dot at (blue, green) grid indices (i, j) is `grid[i][2][j]`, if it was drawn.'''
+    # p2c is separable (x depends only on blue, y only on green)
+    # so work out each row and column coordinate once, not once per dot
+    # (it's inlined here, with its constants hoisted into locals)
+    pct_scale = A.pct_scale
+    x_bias = A.x_bias
+    y_bias = A.y_bias
+
+    pcts = grid_pcts(A)
+    xs = [b * pct_scale + x_bias for b in pcts]
+    ys = [y_bias - g * pct_scale for g in pcts]
+
+    winner_fn = make_winner_fn(A)
+    half_step = A.step/2
+
+    grid = []
+    for (b, x) in zip(pcts, xs):
+        column = []
+        for (g, y) in zip(pcts, ys):
+            r = 1.0 - (g + b)
+            if r < half_step:
+                # on (or past) the two-party edge of the simplex, not worth drawing
+                # (and red only falls further as green goes up the column, so that's it for this one)
+                break
+            column.append((y, r, g, winner_fn(r, g, b)))
+        grid.append((b, x, column))
+
+    return grid
+
+
+def construct_dots(grid: List[Tuple[float, float, list]], A: argparse.Namespace) -> Iterator[str]:
+    '''Yield SVG fragments for a `dot_grid`, one column (of fixed blue) at a time.'''
+    radius = A.radius
+    decimate = A.decimate
+
+    # Coordinates and percentages repeat along every row and column of the grid,
+    # so format each distinct value only once
+    coord = functools.lru_cache(maxsize=None)("{:g}".format)
+    pct_str = functools.lru_cache(maxsize=None)(pct)
+
+    def dot(x_str, b_str, y, r, g, result):
+        return format_dot(x_str, coord(y), pct_str(r), pct_str(g), b_str, result)
+
+    for (b, x, column) in grid:
+        (b_str, x_str) = (pct_str(b), coord(x))
+        parts = []
+        for (cls, run) in itertools.groupby(column, key=lambda dot: outcome_class(dot[3])):
+            run = list(run)
+            if decimate and len(run) > DECIMATE_MIN_RUN:
+                # keep the end dots (and their tooltips), and fill between them with a bar
+                # (green increases up the column, so the last dot is the top one)
+                (first, last) = (run[0], run[-1])
+                parts.append(dot(x_str, b_str, *first))
+                top = run[-2][0] - radius
+                bottom = run[1][0] + radius
+                name = "TIE" if cls == "t" else PARTY_INFO[first[3][0]][0]
+                parts.append(FORMAT_BAR(x - radius, top, 2 * radius, bottom - top, cls, name))
+                parts.append(dot(x_str, b_str, *last))
+            else:
+                parts.extend(dot(x_str, b_str, *d) for d in run)
+        yield "".join(parts)
 
 
 def line(x0: float, y0: float, x1: float, y1: float, A: argparse.Namespace) -> str:
-    """Takes two points (percentage-space) and returns the appropriate path fragment, ensuring that they're all in-bounds."""
+    """Takes two points (percentage-space) and returns the appropriate path fragment, clipped to be in-bounds."""
 
     # we COULD have just used <clipPath> but this is even cleaner in the SVG
 
-    # general principle: there'll be a gradient.
-    # if anything is off the edge, we can replace with appropriate point on the edge
-
-    xa = clamp(x0, A)
-    ya = clamp(y0, A)
-    xb = clamp(x1, A)
-    yb = clamp(y1, A)
-
-    if math.isclose(x0, x1):
-        # special case: vertical line
-        # we can clamp without fear
-        pass
-    elif math.isclose(y0, y1):
-        # horizontal line
-        pass
-    elif (x0 <= A.start and x1 <= A.start) or (y0 <= A.start and y1 <= A.start) or \
-            (x0 >= A.stop and x1 >= A.stop) or (y0 >= A.stop and y1 >= A.stop):
+    start = A.start
+    stop = A.stop
+
+    if start <= x0 <= stop and start <= y0 <= stop and start <= x1 <= stop and start <= y1 <= stop:
+        # the usual case: all in-bounds already, so there's nothing to clip
+        (xp, yp) = p2c(x0, y0, A)
+        (xq, yq) = p2c(x1, y1, A)
+        return f"M {xp:g} {yp:g} {xq:g} {yq:g}"
+
+    # Liang-Barsky: the line is (x0 + t*dx, y0 + t*dy) for t from 0 to 1,
+    # and each edge of the viewport cuts off the t below (entering) or above (leaving) some value
+    dx = x1 - x0
+    dy = y1 - y0
+    (t0, t1) = (0.0, 1.0)
+
+    for (p, q) in ((-dx, x0 - start), (dx, stop - x0), (-dy, y0 - start), (dy, stop - y0)):
+        if p == 0:
+            if q < 0:
+                # parallel to this edge, and outside it
+                return ""
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+
+    if t0 > t1:
         # whole of line would be off-viewport
         return ""
-    else:
-        # get the line equation...
-        m = (y1 - y0)/(x1 - x0)  # gradient
-        c = y0 - m * x0         # y-offset
-
-        if x0 < A.start:
-            ya = m * A.start + c
-        elif x0 > A.stop:
-            ya = m * A.stop + c
-
-        if x1 < A.start:
-            yb = m * A.start + c
-        elif x0 > A.stop:
-            yb = m * A.stop + c
-
-        if y0 < A.start:
-            xa = (A.start - c) / m
-        elif y0 > A.stop:
-            xa = (A.stop - c) / m
-
-        if y1 < A.start:
-            xb = (A.start - c) / m
-        elif y1 > A.stop:
-            xb = (A.stop - c) / m
 
     # Finally, convert to coordinates and return
-    (xp, yp) = p2c(xa, ya, A)
-    (xq, yq) = p2c(xb, yb, A)
+    (xp, yp) = p2c(x0 + t0 * dx, y0 + t0 * dy, A)
+    (xq, yq) = p2c(x0 + t1 * dx, y0 + t1 * dy, A)
 
     return f"M {xp:g} {yp:g} {xq:g} {yq:g}"
 
@@ -360,9 +461,8 @@ def draw_lines(A: argparse.Namespace) -> str:
 
     # Unconditionally we also have a line down y = 1 - x
     # (this passes through the hapoint too, but no direction change)
-    (xtop, ytop) = p2c(1.0 - A.stop, A.stop, A)
-    (xright, yright) = p2c(A.stop, 1.0 - A.stop, A)
-    top_right = f'M {xtop:g} {ytop:g} {xright:g} {yright:g}'
+    # though it's clipped like the others, as it's entirely off the graph if A.stop is under 50%
+    top_right = line(1.0 - A.stop, A.stop, A.stop, 1.0 - A.stop, A)
 
     # OK, time to draw all the lines!
     # print(f'R-G: ({x1:2.1%}, {y1:2.1%}), ({x2:2.1%}, {y2:2.1%}), ({x3:2.1%}, {y3:2.1%})',
@@ -371,10 +471,91 @@ def draw_lines(A: argparse.Namespace) -> str:
     return f'\r\n<path d="{red_green} {red_blue} {blue_green} {top_right}" class="line" />\r\n'
 
 
-def draw_pois(A: argparse.Namespace) -> str:
-    """Draw points of interest, as appearing in the specified CSV file"""
+# Each party's percentage as a linear function of the axes, as (blue coeff, green coeff, constant),
+# indexed as for PARTIES (red is whatever's left over)
+PCT_COEFFS = ((-1.0, -1.0, 1.0), (0.0, 1.0, 0.0), (1.0, 0.0, 0.0))
+
+
+def clip_polygon(points: List[Tuple[float, float]], half_plane: Tuple[float, float, float]) -> List[Tuple[float, float]]:
+    '''Clip a convex polygon, given as a list of (blue, green) vertices, to the half-plane
+        where `cb * blue + cg * green + c0 >= 0` for `half_plane = (cb, cg, c0)`.'''
+    (cb, cg, c0) = half_plane
+    out = []
+    for (i, p) in enumerate(points):
+        q = points[i - 1]  # (the previous vertex, wrapping around)
+        dp = cb * p[0] + cg * p[1] + c0
+        dq = cb * q[0] + cg * q[1] + c0
+        if dp * dq < 0:
+            # the edge from q to p crosses the boundary, so add the crossing point
+            t = dq / (dq - dp)
+            out.append((q[0] + t * (p[0] - q[0]), q[1] + t * (p[1] - q[1])))
+        if dp >= 0:
+            out.append(p)
+    return out
+
 
-    def inner(row):
+def draw_regions(A: argparse.Namespace) -> str:
+    """Draw the region each party wins as filled polygons, an exact (and much smaller) alternative to the dots."""
+
+    # flows[i][j] is the preference flow from party i to party j, as in tied_third_code
+    flows = ((0.0, A.red_to_green, A.red_to_blue),
+             (A.green_to_red, 0.0, A.green_to_blue),
+             (A.blue_to_red, A.blue_to_green, 0.0))
+
+    def combine(*terms):
+        # a weighted sum of PCT_COEFFS-style linear functions
+        return tuple(sum(w * c[n] for (w, c) in terms) for n in range(3))
+
+    # the visible part of the graph (where red is non-negative)
+    viewport = [(A.start, A.start), (A.stop, A.start), (A.stop, A.stop), (A.start, A.stop)]
+    viewport = clip_polygon(viewport, PCT_COEFFS[0])
+
+    # Everything's linear, so the part of the graph where `winner` beats `other` with `third` in third place
+    # is a convex polygon: the viewport, cut down by three half-planes
+    parts = ['<g class="regions">']
+    for (winner, party) in enumerate(PARTIES):
+        (name, cls) = PARTY_INFO[party]
+        for third in OTHERS[winner]:
+            other = 3 - winner - third
+            (w, o, t) = (PCT_COEFFS[winner], PCT_COEFFS[other], PCT_COEFFS[third])
+            poly = viewport
+            for half_plane in (combine((1, w), (-1, t)), combine((1, o), (-1, t)),
+                               combine((1, w), (-1, o), (flows[third][winner] - flows[third][other], t))):
+                poly = clip_polygon(poly, half_plane)
+            if len(poly) < 3:
+                continue
+            points = " ".join(f"{x:g},{y:g}" for (x, y) in (p2c(b, g, A) for (b, g) in poly))
+            parts.append(f'<polygon points="{points}" class="{cls}"><title>Winner: {name}</title></polygon>')
+    parts.append('</g>')
+    return "".join(parts)
+
+
+def draw_pois(A: argparse.Namespace, grid: Optional[List[Tuple[float, float, list]]] = None) -> str:
+    """Draw points of interest, as appearing in the specified CSV file.
+    `grid` is the `dot_grid` for the same `A`, if it's been drawn,
+    and its results are reused for points that fall exactly on it."""
+
+    winner_fn = make_winner_fn(A)
+    grid = grid or []
+    (start, step) = (A.start, A.step)
+
+    def poi_winner(blue_pct, green_pct):
+        i = (blue_pct - start) / step
+        j = (green_pct - start) / step
+        (ii, jj) = (round(i), round(j))
+        if abs(i - ii) < 1e-9 and abs(j - jj) < 1e-9 and 0 <= ii < len(grid) and 0 <= jj < len(grid[ii][2]):
+            return grid[ii][2][jj][3]
+        return winner_fn(1 - (blue_pct + green_pct), green_pct, blue_pct)
+
+    def poi_outcome(blue_pct, green_pct):
+        result = poi_winner(blue_pct, green_pct)
+        if result is None:  # a tie
+            return "TIE"
+        (winner, margin) = result
+        return PARTY_INFO[winner][0] + " " + pct(margin)
+
+    def parse(row):
+        '''(blue, green, label) for a row, or None if it's no good'''
         try:
             r0 = float(row[0])
             r1 = float(row[1])
@@ -382,62 +563,56 @@ def draw_pois(A: argparse.Namespace) -> str:
             if r0 + r1 > 1.0:
                 raise ValueError("sum of X and Y columns must be <= 1")
 
-            r2 = row[2] if len(row) > 2 else ""
-            (x, y) = p2c(r0, r1, A)
-            tooltip = f"{r2}\n{Party.GREEN.value[0]}: {r1:.1%}, {Party.RED.value[0]}: {(1 - (r1+r0)):.1%}, {Party.BLUE.value[0]}: {r0:.1%}.".replace(
-                ".0%", "%")
-
-            try:
-                (winner, margin) = calculate_winner(1 - (r0 + r1), r1, r0, A)
-                tooltip += f"\nWinner: {winner.value[0]} {margin:.1%}".replace(
-                    ".0%", "%")
-            except TypeError:  # ties A.n
-                tooltip += "\nWinner: TIE"
-            return  f'<circle cx="{x:g}" cy="{y:g}" r="{A.radius:g}" class="d poi"><title>{tooltip}</title></circle>\r\n'
+            return (r0, r1, row[2] if len(row) > 2 else "")
 
         except (TypeError, IndexError, ValueError) as e:
             print("Could not parse input row:", e, file=sys.stderr)
             print(row, file=sys.stderr)
-            return ''
-
+            return None
 
-    out = ""
+    # Read and check all the rows first, then draw the good ones in one go
+    pois = [parse(row) for row in A.point or []]
 
-    for row in A.point:
-        out += inner(row)
-        
     if A.input:
-        import csv
-        rdr = csv.reader(sys.stdin if A.input == "-" else open(A.input, 'r'))
-        for row in rdr:
-            out += inner(row)
-        
-    return out
+        # (we don't close stdin, but do close the file when we're done with it)
+        with contextlib.nullcontext(sys.stdin) if A.input == "-" else open(A.input, 'r') as f:
+            pois.extend(parse(row) for row in csv.reader(f))
 
+    pois = list(filter(None, pois))
+
+    # Work out the tooltips and positions up front, then format all the circles in one pass
+    tooltips = [f"{r2}\n{FORMAT_3CP(pct(r1), pct(1 - (r1+r0)), pct(r0))}\nWinner: {poi_outcome(r0, r1)}"
+                for (r0, r1, r2) in pois]
+    coords = [p2c(r0, r1, A) for (r0, r1, _) in pois]
+
+    return "".join(map(FORMAT_POI,
+                       (x for (x, _) in coords), (y for (_, y) in coords),
+                       itertools.repeat(f"{A.radius:g}"), tooltips))
 
-def construct_svg(A: argparse.Namespace) -> str:
-    """Returns an SVG of the graph for given parameters as specified in `A`."""
-    # let's output some SVG!
 
-    out = ""
+def construct_svg_iter(A: argparse.Namespace) -> Iterator[str]:
+    """Yields an SVG of the graph for given parameters as specified in `A`, in fragments.
+    This lets callers stream it out rather than holding the whole thing in memory."""
+    # let's output some SVG!
 
-    out += f'<svg viewBox="0 0 {A.width:.0f} {A.width:.0f}" version="1.1" xmlns="http://www.w3.org/2000/svg">'
+    yield f'<svg viewBox="0 0 {A.width:.0f} {A.width:.0f}" version="1.1" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
 
-    # Set up <defs> section, including our triangle marker, the keyline effect and our CSS
+    # Set up <defs> section, including our triangle marker, the keyline effect,
+    # a template dot for each outcome and our CSS
 
     css = DEFAULT_CSS
     if A.css:
         css = (A.css).read()
 
-    out += '<defs>' + \
-        f'<marker id="triangle" viewBox="0 0 10 10" \
+    yield '<defs>'
+    yield f'<marker id="triangle" viewBox="0 0 10 10" \
             refX="1" refY="5" \
             markerUnits="strokeWidth" \
             markerWidth="{A.scale * 0.5}" markerHeight="{A.scale * 0.5}" \
             orient="auto"> \
         <path d="M 0 0 L 10 5 L 0 10 z"/> \
-        </marker>' + \
-        """<filter id="keylineEffect" color-interpolation-filters="sRGB">
+        </marker>'
+    yield """<filter id="keylineEffect" color-interpolation-filters="sRGB">
             <feMorphology in="SourceGraphic" operator="dilate" radius="2"/>
             <feColorMatrix type="saturate" values="0" />
             <feComponentTransfer in="greyed" result="KEYLINE">
@@ -449,78 +624,89 @@ def construct_svg(A: argparse.Namespace) -> str:
                 <feMergeNode in="KEYLINE"/>
                 <feMergeNode in="SourceGraphic"/>
             </feMerge>
-        </filter>""" + \
-        f'<style type="text/css"><![CDATA[ \
+        </filter>"""
+    yield "".join(f'<circle id="d{c}" r="{A.radius:g}" class="{c}"/>' for c in "rgbt")
+    yield f'<style type="text/css"><![CDATA[ \
             {css} \
         ]]> \
-        </style>' + \
-        '</defs>'
+        </style>'
+    yield '</defs>'
 
     # place a bg rect
 
-    out += f'<rect width="{A.width:.0f}" height="{A.width:.0f}" class="bg" />'
+    yield f'<rect width="{A.width:.0f}" height="{A.width:.0f}" class="bg" />'
 
-    # place our dots
+    # place our dots, or the regions they're sampling
 
-    for b in frange(A.start, (A.stop + A.step), A.step):
-        for g in frange(A.start, (A.stop + A.step), A.step):
-            if g + b > 1.0:
-                continue
-            out += construct_dot(b, g, A)
+    grid = None
+    if A.regions:
+        yield draw_regions(A)
+    else:
+        grid = dot_grid(A)
+        yield from construct_dots(grid, A)
 
     # Draw change-of-winner lines
-    out += draw_lines(A)
+    yield draw_lines(A)
 
     # place points of interest
     if A.input or A.point:
-        out += draw_pois(A)
+        yield draw_pois(A, grid)
 
     # Draw labels stating preference assumptions
-    out += '<g id="preflabel">'
+    yield '<g id="preflabel">'
     # place a rect
-    out += f'<rect width="{A.scale*13:g}" height="{6.5*A.scale:g}" x="{A.width - A.scale*12.5:g}" y="{A.scale:g}" class="bg"/>'
-    out += f'<text x="{A.width - A.scale*12:g}" y="{2*A.scale:g}" style="font-size:{A.scale:g}">{Party.RED.value[0]} to {Party.GREEN.value[0]}: {100.0*A.red_to_green:.1f}%</text>'
-    out += f'<text x="{A.width - A.scale*12:g}" y="{3*A.scale:g}" style="font-size:{A.scale:g}">{Party.RED.value[0]} to {Party.BLUE.value[0]}: {100.0*A.red_to_blue:.1f}%</text>'
-    out += f'<text x="{A.width - A.scale*12:g}" y="{4*A.scale:g}" style="font-size:{A.scale:g}">{Party.GREEN.value[0]} to {Party.RED.value[0]}: {100.0*A.green_to_red:.1f}%</text>'
-    out += f'<text x="{A.width - A.scale*12:g}" y="{5*A.scale:g}" style="font-size:{A.scale:g}">{Party.GREEN.value[0]} to {Party.BLUE.value[0]}: {100.0*A.green_to_blue:.1f}%</text>'
-    out += f'<text x="{A.width - A.scale*12:g}" y="{6*A.scale:g}" style="font-size:{A.scale:g}">{Party.BLUE.value[0]} to {Party.RED.value[0]}: {100.0*A.blue_to_red:.1f}%</text>'
-    out += f'<text x="{A.width - A.scale*12:g}" y="{7*A.scale:g}" style="font-size:{A.scale:g}">{Party.BLUE.value[0]} to {Party.GREEN.value[0]}: {100.0*A.blue_to_green:.1f}%</text>'
-    out += '</g>'
+    yield f'<rect width="{A.scale*13:g}" height="{6.5*A.scale:g}" x="{A.width - A.scale*12.5:g}" y="{A.scale:g}" class="bg"/>'
+    flows = ((Party.RED, Party.GREEN, A.red_to_green), (Party.RED, Party.BLUE, A.red_to_blue),
+             (Party.GREEN, Party.RED, A.green_to_red), (Party.GREEN, Party.BLUE, A.green_to_blue),
+             (Party.BLUE, Party.RED, A.blue_to_red), (Party.BLUE, Party.GREEN, A.blue_to_green))
+    yield "".join(f'<text x="{A.width - A.scale*12:g}" y="{i*A.scale:g}" style="font-size:{A.scale:g}">{src.value[0]} to {dst.value[0]}: {100.0*flow:.1f}%</text>'
+                  for (i, (src, dst, flow)) in enumerate(flows, start=2))
+    yield '</g>'
 
     (x0, y0) = p2c(A.start, A.start,  A)
     (x0, y100) = p2c(A.start, A.stop,   A)
     (x100, y0) = p2c(A.stop,  A.start,  A)
 
+    axis_style = f"stroke: #222; stroke-width: {A.scale * 0.2:g}px"
+    # the marks that fall on the graph, with their labels
+    marks = [(m, f"{m:.0%}") for m in A.marks if m > A.start and m <= A.stop]
+
     # Draw Y axis
-    out += f'<path d="M {x0:g} {A.width:g} V {y100:g}" style="stroke: #222; stroke-width: {A.scale * 0.2:g}px" marker-end="url(#triangle)"/>'
-    out += f'<text transform="translate({(x0 - (A.offset - 1)*A.scale):g}, {A.width/2 :g}) rotate(270)" style="text-anchor:middle">{Party.GREEN.value[0]} 3CP</text>'
+    yield f'<path d="M {x0:g} {A.width:g} V {y100:g}" style="{axis_style}" marker-end="url(#triangle)"/>'
+    yield f'<text transform="translate({(x0 - (A.offset - 1)*A.scale):g}, {A.width/2 :g}) rotate(270)" style="text-anchor:middle">{Party.GREEN.value[0]} 3CP</text>'
 
-    for g in A.marks:
-        if g > A.start and g <= (A.stop):
-            (xpos, ypos) = p2c(A.start, g, A)
-            out += f'<path d="M {xpos:g} {ypos:g} h {-A.scale:g}" style="stroke: #222; stroke-width: {A.scale * 0.2:g}px"/>'
-            out += f'<text y="{(ypos + A.scale/2):g}" x="{(xpos - 3*A.scale):g}" style="font-size:{A.scale:g}; text-anchor:right; text-align:middle">{g:.0%}</text>'
+    yield "".join(f'<path d="M {xpos:g} {ypos:g} h {-A.scale:g}" style="{axis_style}"/>'
+                  f'<text y="{(ypos + A.scale/2):g}" x="{(xpos - 3*A.scale):g}" style="font-size:{A.scale:g}; text-anchor:right; text-align:middle">{label}</text>'
+                  for ((xpos, ypos), label) in ((p2c(A.start, g, A), label) for (g, label) in marks))
 
     # Draw X axis
-    out += f'<path d="M {0:g} {y0:g} H {x100:g}" style="stroke: #222; stroke-width: {A.scale * 0.2:g}px" marker-end="url(#triangle)"/>'
-    out += f'<text x="{A.width/2:g}" y="{y0 + 3.5*A.scale:g}" style="text-anchor:middle">{Party.BLUE.value[0]} 3CP</text>'
+    yield f'<path d="M {0:g} {y0:g} H {x100:g}" style="{axis_style}" marker-end="url(#triangle)"/>'
+    yield f'<text x="{A.width/2:g}" y="{y0 + 3.5*A.scale:g}" style="text-anchor:middle">{Party.BLUE.value[0]} 3CP</text>'
 
-    for b in A.marks:
-        if b > A.start and b <= (A.stop):
-            (xpos, ypos) = p2c(b, A.start, A)
-            out += f'<path d="M {xpos:g} {ypos:g} v {A.scale:g}" style="stroke: #222; stroke-width: {A.scale * 0.2:g}px"/>'
-            out += f'<text x="{xpos:g}" y="{ypos + 2*A.scale:g}" style="font-size:{A.scale}; text-anchor:middle">{b:.0%}</text>'
+    yield "".join(f'<path d="M {xpos:g} {ypos:g} v {A.scale:g}" style="{axis_style}"/>'
+                  f'<text x="{xpos:g}" y="{ypos + 2*A.scale:g}" style="font-size:{A.scale}; text-anchor:middle">{label}</text>'
+                  for ((xpos, ypos), label) in ((p2c(b, A.start, A), label) for (b, label) in marks))
 
-    out += "\r\n<!-- Generated by https://abjago.net/3pp/ -->\r\n"
-    out += "</svg>"
+    yield "\r\n<!-- Generated by https://abjago.net/3pp/ -->\r\n"
+    yield "</svg>"
+
+
+def construct_svg(A: argparse.Namespace) -> str:
+    """Returns an SVG of the graph for given parameters as specified in `A`."""
+    return "".join(construct_svg_iter(A))
 
-    return out
+
+def write_svg(A: argparse.Namespace, out) -> None:
+    """Writes an SVG of the graph for given parameters as specified in `A` to the file `out`,
+    a fragment at a time, so it's never all in memory at once."""
+    for chunk in construct_svg_iter(A):
+        out.write(chunk)
+    out.write("\n")
 
 
 def get_args(args=None) -> argparse.Namespace:
     """pass args='' for defaults, or leave as None for checking argv.
     DEFAULT VALUES are set here."""
-    import argparse
 
     parser = argparse.ArgumentParser(description=f"Three-Candidate-Preferred Visualiser.\
         Constructs a 2D graph with {Party.BLUE.value[0]} on the X-axis, \
@@ -552,6 +738,10 @@ def get_args(args=None) -> argparse.Namespace:
                         help="multiple of scale factor to A.offset axis by (default: %(default)g)")
     parser.add_argument("--marks", nargs='+', default=[i/10.0 for i in range(0, 10)], metavar="MARK", type=float,
                         help="place axis marks at these values (default: every 10%%)")
+    parser.add_argument("--decimate", action=argparse.BooleanOptionalAction, default=True,
+                        help=f"draw runs of more than {DECIMATE_MIN_RUN} same-winner dots as a bar between the end dots (default: %(default)s)")
+    parser.add_argument("--regions", action=argparse.BooleanOptionalAction, default=False,
+                        help="draw each party's winning region as a filled shape, instead of dots (default: %(default)s)")
     parser.add_argument("--css", metavar='FILE',
                         type=argparse.FileType('r'), help="Use CSS from specified file")
     parser.add_argument("--point", metavar=('X', 'Y', 'LABEL'), nargs=3, action='append', help="Specify a point of interest")
@@ -580,6 +770,11 @@ def validate_args(A: argparse.Namespace) -> argparse.Namespace:
     # A.scale is pixels per percent, A.step is percent per dot
     A.radius = 50.0 * A.scale * A.step
 
+    # p2c constants: pixels per unit percentage, and the pixel position of 0%
+    A.pct_scale = A.inner_width / (A.stop - A.start)
+    A.x_bias = A.offset * A.scale - A.start * A.pct_scale
+    A.y_bias = A.inner_width + A.scale + A.start * A.pct_scale
+
     # Clamp our preference flows...
 
     A.green_to_red = max(min(abs(A.green_to_red),  1.0), 0.0)
@@ -605,6 +800,12 @@ def validate_args(A: argparse.Namespace) -> argparse.Namespace:
         A.blue_to_green /= blue_total
         A.blue_to_red /= blue_total
 
+    # The flows together, in the order `tied_third_code` takes them,
+    # and the tolerance used for comparing percentages
+    A.prefs = (A.red_to_green, A.red_to_blue, A.green_to_red,
+               A.green_to_blue, A.blue_to_red, A.blue_to_green)
+    A.tol = A.step/10.0
+
     return A
 
 
@@ -613,6 +814,6 @@ if __name__ == "__main__":
     try:
         A = validate_args(get_args())
         print(A, file=sys.stderr)
-        print(construct_svg(A), file=A.output)
+        write_svg(A, A.output)
     except ValueError as e:
         print(e, file=sys.stderr)